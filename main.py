@@ -1,9 +1,6 @@
-import pandas as pd
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
 from datetime import datetime
 from PIL import Image, ImageTk
 from tkinter import ttk
@@ -48,16 +45,196 @@ def carregar_planilha_mestre_auto(self):
         messagebox.showerror("Erro", str(e))
 
 
+# ===============================
+#  REGRAS (regras.json)
+# ===============================
+
+CAMINHO_REGRAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regras.json")
+
+def _preenchimento(cor):
+    from openpyxl.styles import PatternFill
+
+    return PatternFill(start_color=cor, end_color=cor, fill_type="solid")
+
+def _compilar_predicado(regra):
+    """
+    Converte uma regra de destaque ('termina_com', 'comeca_com' ou
+    'igual_a', cada uma com uma lista de textos, comparados após
+    remover espaços, diferenciando maiúsculas de minúsculas) em:
+    - uma função Series -> máscara booleana (vetorizada)
+    - uma função letra da coluna -> fórmula do Excel para a linha 1
+    """
+    def texto_excel(valor):
+        return '"' + valor.replace('"', '""') + '"'
+
+    if "termina_com" in regra:
+        textos = tuple(regra["termina_com"])
+        metodo = "endswith"
+        formula = lambda ref, t: f"EXACT(RIGHT(TRIM({ref}),{len(t)}),{texto_excel(t)})"
+    elif "comeca_com" in regra:
+        textos = tuple(regra["comeca_com"])
+        metodo = "startswith"
+        formula = lambda ref, t: f"EXACT(LEFT(TRIM({ref}),{len(t)}),{texto_excel(t)})"
+    elif "igual_a" in regra:
+        textos = tuple(regra["igual_a"])
+        metodo = None
+        formula = lambda ref, t: f"EXACT(TRIM({ref}),{texto_excel(t)})"
+    else:
+        raise ValueError(f"Regra de destaque sem predicado: {regra}")
+
+    def mascara(serie):
+        # Só valores de texto podem ser destacados; os demais viram NaN
+        eh_texto = serie.map(lambda valor: isinstance(valor, str))
+        valores = serie.astype(object).where(eh_texto).str.strip()
+        if metodo:
+            resultado = getattr(valores.str, metodo)(textos)
+        else:
+            resultado = valores.isin(textos)
+        return resultado.fillna(False).astype(bool)
+
+    def formula_excel(letra):
+        return "OR(" + ",".join(formula(f"{letra}1", t) for t in textos) + ")"
+
+    return mascara, formula_excel
+
+class Regras:
+    """
+    Regras de 'regras.json' já compiladas: termos de busca do
+    cabeçalho, nomes padrão das colunas, filtros e aviso (valores
+    aceitos por coluna), esquema da mestre, colunas comparadas na
+    deduplicação e os estilos/destaques da planilha de saída.
+    """
+
+    def __init__(self, config):
+        colunas = config["colunas"]
+        # Termos de cada coluna (busca + apelidos), como no cabeçalho
+        self.colunas_busca = [[c["busca"]] + c.get("apelidos", []) for c in colunas]
+        self._termos = [
+            (c["nome"], [t.lower() for t in [c["busca"]] + c.get("apelidos", [])])
+            for c in colunas
+        ]
+        self.obrigatorias = list(config.get("obrigatorias", []))
+        self.filtros = {col: frozenset(v) for col, v in config.get("filtros", {}).items()}
+        self.aviso = {col: frozenset(v) for col, v in config.get("aviso", {}).items()}
+        self.colunas_conflito = list(config.get("conflitos", []))
+        self.colunas_mestre = list(config["mestre"])
+        # Colunas lidas pelo programa, que recebem o nome padrão
+        self.colunas_usadas = (
+            {"Registro"} | set(self.obrigatorias) | set(self.filtros) | set(self.colunas_conflito)
+        )
+
+        estilos = config.get("estilos", {})
+        cabecalho = estilos.get("cabecalho", {})
+        self._cabecalho_padrao = _preenchimento(cabecalho.get("cor_padrao", "ADD8E6"))
+        self._cabecalho_por_coluna = {
+            col: _preenchimento(cor) for col, cor in cabecalho.get("cores", {}).items()
+        }
+        self.preenchimento_turno = _preenchimento(estilos.get("turno", "FFA500"))
+
+        self.destaques = []
+        for regra in config.get("destaques", []):
+            mascara, formula = _compilar_predicado(regra)
+            self.destaques.append((regra["coluna"], mascara, formula, _preenchimento(regra["cor"])))
+
+    def nome_padrao(self, coluna):
+        """
+        Nome padrão da coluna cujo termo (busca ou apelido) aparece
+        no cabeçalho 'coluna', ou None.
+        """
+        coluna = str(coluna).lower()
+        for nome, termos in self._termos:
+            if any(t in coluna for t in termos):
+                return nome
+        return None
+
+    def termo_exato(self, nome, coluna):
+        """
+        Indica se o cabeçalho 'coluna' é exatamente um dos termos
+        da coluna padrão 'nome'.
+        """
+        coluna = str(coluna).lower().strip()
+        return any(coluna == t for n, termos in self._termos if n == nome for t in termos)
+
+    def posicoes_padrao(self, cabecalho, nomes):
+        """
+        Posição, em 'cabecalho', de cada coluna padrão de 'nomes' que
+        existir ({nome: posição}). Se mais de um cabeçalho corresponder
+        ao mesmo nome, vale o que for exatamente um dos termos; se não
+        houver um único assim, levanta ValueError.
+        """
+        nomes_padrao = [self.nome_padrao(coluna) for coluna in cabecalho]
+        posicoes = {}
+        for nome in nomes:
+            candidatas = [i for i, n in enumerate(nomes_padrao) if n == nome]
+            if len(candidatas) > 1:
+                exatas = [i for i in candidatas if self.termo_exato(nome, cabecalho[i])]
+                if len(exatas) != 1:
+                    encontradas = ", ".join(f"'{cabecalho[i]}'" for i in candidatas)
+                    raise ValueError(f"Mais de uma coluna para '{nome}': {encontradas}.")
+                candidatas = exatas
+            if candidatas:
+                posicoes[nome] = candidatas[0]
+        return posicoes
+
+    def preenchimento_cabecalho(self, coluna):
+        return self._cabecalho_por_coluna.get(coluna, self._cabecalho_padrao)
+
+    def mascara_filtro(self, df):
+        """
+        Linhas com valores aceitos em todas as colunas de 'filtros',
+        já normalizadas (maiúsculas, sem espaços nas pontas). Se alguma
+        delas faltar, nada é filtrado.
+        """
+        import pandas as pd
+
+        mascara = pd.Series(True, index=df.index)
+        if not all(col in df.columns for col in self.filtros):
+            return mascara
+        for col, aceitos in self.filtros.items():
+            mascara &= df[col].isin(aceitos)
+        return mascara
+
+    def mascaras_destaque(self, planilha):
+        """
+        Para cada destaque cuja coluna existe em 'planilha':
+        (posição da coluna, máscara das linhas, preenchimento).
+        """
+        resultado = []
+        for coluna, mascara, _, preenchimento in self.destaques:
+            if coluna in planilha.columns:
+                posicao = list(planilha.columns).index(coluna)
+                resultado.append((posicao, mascara(planilha.iloc[:, posicao]).to_numpy(), preenchimento))
+        return resultado
+
+# Regras já compiladas, por caminho do arquivo
+_REGRAS_CARREGADAS = {}
+
+def obter_regras(caminho=CAMINHO_REGRAS):
+    """
+    Carrega e compila 'regras.json' uma única vez por processo.
+    """
+    if caminho not in _REGRAS_CARREGADAS:
+        import json
+
+        try:
+            with open(caminho, encoding="utf-8") as arquivo:
+                _REGRAS_CARREGADAS[caminho] = Regras(json.load(arquivo))
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Arquivo de regras não encontrado: {caminho}")
+    return _REGRAS_CARREGADAS[caminho]
+
 def encontrar_cabecalho_personalizado(df, colunas_busca, max_linhas=15):
     """
     Tenta encontrar, nas primeiras 'max_linhas' do DataFrame,
     as colunas especificadas em 'colunas_busca', mesmo que
-    estejam em linhas diferentes.
+    estejam em linhas diferentes. Cada item de 'colunas_busca' é um
+    termo ou uma lista de termos alternativos (apelidos) da coluna.
 
     Retorna:
     - Uma lista de nomes de colunas unificados, se encontrado
     - O índice (linha) até onde foi usado para compor o cabeçalho
     """
+    grupos = [[b] if isinstance(b, str) else list(b) for b in colunas_busca]
     num_cols = df.shape[1]
     header_acumulado = [""] * num_cols
     linha_final_cabecalho = 0
@@ -72,8 +249,11 @@ def encontrar_cabecalho_personalizado(df, colunas_busca, max_linhas=15):
                     header_acumulado[c] = val
                 else:
                     header_acumulado[c] += f" {val}"
-        colunas_encontradas = [h for h in header_acumulado if any(b in h for b in colunas_busca)]
-        if len(colunas_encontradas) >= len(colunas_busca):
+        colunas_encontradas = [
+            termos for termos in grupos
+            if any(t in h for h in header_acumulado for t in termos)
+        ]
+        if len(colunas_encontradas) >= len(grupos):
             linha_final_cabecalho = i
             break
 
@@ -85,7 +265,11 @@ def carregar_planilha_e_filtrar(caminho_arquivo):
     e filtra os dados com base nas colunas necessárias e nos valores
     'SIM' ou 'X' nas colunas 'Optante de transporte' e 'Usará transporte na HE'.
     Agora a comparação é por 'Reg.' (renomeado para 'Registro').
+    O arquivo não é alterado: a desmesclagem é feita em memória.
     """
+    import pandas as pd
+    from openpyxl import load_workbook
+
     # Se for .xlsb, carregamos diretamente com pandas (pyxlsb)
     # e PULAMOS o trecho de openpyxl (pois não há suporte para .xlsb).
     if caminho_arquivo.lower().endswith(".xlsb"):
@@ -95,91 +279,198 @@ def carregar_planilha_e_filtrar(caminho_arquivo):
             header=None
         )
     else:
-        df = pd.read_excel(
-            caminho_arquivo,
-            engine=None,  # openpyxl por padrão
-            header=None
-        )
+        from io import BytesIO
+
         wb = load_workbook(caminho_arquivo)
         ws = wb.active
         ws = quebrar_celulas_mescladas(ws)
-        wb.save(caminho_arquivo)
 
-        # Recarrega após desmesclar
+        # Lê a versão desmesclada a partir da memória, sem regravar o arquivo
+        buffer = BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
         df = pd.read_excel(
-            caminho_arquivo,
-            engine=None,
+            buffer,
+            engine="openpyxl",
             header=None
         )
 
-    # Colunas que queremos identificar no cabeçalho
-    colunas_desejadas = [
-        "Reg.", "Nome empregado", "Unidade de Negócio", "Turno",
-        "Optante de transporte", "Usará transporte na HE", "LANCHE",
-        "HORARIO DE SAÍDA", "OBSERVAÇÃO"
-    ]
+    regras = obter_regras()
 
     # Monta o cabeçalho personalizadamente
-    header_unificado, idx_cabecalho = encontrar_cabecalho_personalizado(df, colunas_desejadas, max_linhas=15)
+    header_unificado, idx_cabecalho = encontrar_cabecalho_personalizado(df, regras.colunas_busca, max_linhas=15)
     df.columns = header_unificado
     df = df.iloc[idx_cabecalho + 1:].copy()
 
     # Mantém só as colunas de interesse
-    colunas_existentes = [col for col in df.columns if any(c.lower() in col.lower() for c in colunas_desejadas)]
-    if not colunas_existentes:
+    nomes_padrao = [regras.nome_padrao(col) for col in df.columns]
+    posicoes = [i for i, nome in enumerate(nomes_padrao) if nome]
+    if not posicoes:
         raise ValueError("Nenhuma das colunas necessárias foi encontrada na planilha.")
 
-    df = df[colunas_existentes].copy()
-
-    # Renomeia colunas para o padrão que usaremos
-    for c in df.columns:
-        if "reg." in c.lower():
-            df.rename(columns={c: "Registro"}, inplace=True)
-        if "optante de transporte" in c.lower():
-            df.rename(columns={c: "Optante de transporte"}, inplace=True)
-        if "usará transporte na he" in c.lower():
-            df.rename(columns={c: "Usará transporte na HE"}, inplace=True)
-        if "nome empregado" in c.lower():
-            df.rename(columns={c: "Nome empregado"}, inplace=True)
-
-    # Remove linhas onde "Nome empregado" é NaN (opcional)
-    if "Nome empregado" in df.columns:
-        df = df[df["Nome empregado"].notna()]
-
-    # Normaliza valores de transporte (SIM ou X)
-    if "Optante de transporte" in df.columns:
-        df["Optante de transporte"] = (
-            df["Optante de transporte"].astype(str).str.upper().str.strip()
-        )
-    if "Usará transporte na HE" in df.columns:
-        df["Usará transporte na HE"] = (
-            df["Usará transporte na HE"].astype(str).str.upper().str.strip()
-        )
+    colunas = list(df.columns)
+    df = df.iloc[:, posicoes].copy()
 
-    # Filtra somente quem tiver SIM ou X em ambas as colunas
-    if "Optante de transporte" in df.columns and "Usará transporte na HE" in df.columns:
-        df = df[
-            (df["Optante de transporte"].isin(["SIM", "X"])) &
-            (df["Usará transporte na HE"].isin(["SIM", "X"]))
-        ]
+    # Renomeia para o nome padrão só as colunas que o programa usa
+    renomear = {i: nome for nome, i in regras.posicoes_padrao(colunas, regras.colunas_usadas).items()}
+    df.columns = [renomear.get(i, colunas[i]) for i in posicoes]
+
+    # Normaliza os valores das colunas de filtro (ex.: SIM ou X)
+    for col in regras.filtros:
+        if col in df.columns:
+            df[col] = df[col].astype(str).str.upper().str.strip()
+
+    # Remove linhas sem os campos obrigatórios
+    obrigatorias = [col for col in regras.obrigatorias if col in df.columns]
+    if obrigatorias:
+        df = df[df[obrigatorias].notna().all(axis=1)]
+
+    # Filtra somente quem tiver valores aceitos nas colunas de filtro
+    df = df[regras.mascara_filtro(df)]
 
     return df
 
-def comparar_planilhas(caminho_mestre, caminhos_comparacao):
+def _localizar_colunas(linhas_cabecalho, nomes, max_linhas=15):
     """
-    Compara a planilha mestre com diversas planilhas de comparação
-    pela coluna 'Registro' (removendo zeros à esquerda para ambas).
+    Aplica 'encontrar_cabecalho_personalizado' às primeiras linhas da
+    planilha e retorna (linha final do cabeçalho, [posição de cada
+    coluna de 'nomes']), ou None se alguma delas não existir. As
+    colunas são escolhidas como em 'carregar_planilha_e_filtrar'
+    ('Regras.posicoes_padrao').
     """
-    if not caminho_mestre or not caminhos_comparacao:
-        raise ValueError("Selecione a planilha mestre e as planilhas para comparação.")
+    import pandas as pd
+
+    if not linhas_cabecalho:
+        return None
+
+    regras = obter_regras()
+    df_cabecalho = pd.DataFrame([list(linha) for linha in linhas_cabecalho])
+    header_unificado, idx_cabecalho = encontrar_cabecalho_personalizado(
+        df_cabecalho, regras.colunas_busca, max_linhas=max_linhas
+    )
+
+    posicoes = regras.posicoes_padrao(header_unificado, nomes)
+    if not all(nome in posicoes for nome in nomes):
+        return None
+    return idx_cabecalho, [posicoes[nome] for nome in nomes]
+
+def _linhas_com_aviso(linhas, condicoes):
+    """
+    Percorre as linhas e para na primeira em que todas as
+    'condicoes' ([(posição, valores)]) são atendidas.
+    """
+    maior = max(posicao for posicao, _ in condicoes)
+    for linha in linhas:
+        if maior >= len(linha):
+            continue
+        if all(str(linha[posicao]).upper().strip() in valores for posicao, valores in condicoes):
+            return True
+    return False
+
+def planilha_tem_nao(caminho, max_linhas=15):
+    """
+    Verifica se a planilha tem alguma linha que atende ao 'aviso' das
+    regras ('NÃO' em 'Optante de transporte' e 'Usará transporte na HE').
+
+    Lê só as primeiras 'max_linhas' para achar o cabeçalho; depois
+    percorre apenas as colunas do aviso e para na primeira
+    ocorrência. Não altera o arquivo.
+    """
+    from itertools import chain, islice
+
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    aviso = obter_regras().aviso
+    if not aviso:
+        return False
+    nomes = list(aviso)
+
+    if caminho.lower().endswith(".xlsx"):
+        wb = load_workbook(caminho, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0]
+            cabecalho = list(ws.iter_rows(max_row=max_linhas, values_only=True))
+            colunas = _localizar_colunas(cabecalho, nomes, max_linhas)
+            if colunas is None:
+                return False
+            idx_cabecalho, posicoes = colunas
+
+            # Lê só o trecho entre as colunas do aviso, a partir dos dados
+            menor = min(posicoes)
+            linhas = ws.iter_rows(
+                min_row=idx_cabecalho + 2,
+                min_col=menor + 1,
+                max_col=max(posicoes) + 1,
+                values_only=True
+            )
+            return _linhas_com_aviso(
+                linhas, [(p - menor, aviso[nome]) for p, nome in zip(posicoes, nomes)]
+            )
+        finally:
+            wb.close()
+
+    if caminho.lower().endswith(".xlsb"):
+        from pyxlsb import open_workbook
+
+        with open_workbook(caminho) as wb:
+            with wb.get_sheet(1) as sheet:
+                linhas = ([c.v for c in row] for row in sheet.rows())
+                cabecalho = list(islice(linhas, max_linhas))
+                colunas = _localizar_colunas(cabecalho, nomes, max_linhas)
+                if colunas is None:
+                    return False
+                idx_cabecalho, posicoes = colunas
+                return _linhas_com_aviso(
+                    chain(cabecalho[idx_cabecalho + 1:], linhas),
+                    [(p, aviso[nome]) for p, nome in zip(posicoes, nomes)]
+                )
+
+    # .xls: sem leitura em streaming, usa o pandas
+    df = pd.read_excel(caminho, header=None)
+    linhas = df.itertuples(index=False, name=None)
+    cabecalho = list(islice(linhas, max_linhas))
+    colunas = _localizar_colunas(cabecalho, nomes, max_linhas)
+    if colunas is None:
+        return False
+    idx_cabecalho, posicoes = colunas
+    return _linhas_com_aviso(
+        chain(cabecalho[idx_cabecalho + 1:], linhas),
+        [(p, aviso[nome]) for p, nome in zip(posicoes, nomes)]
+    )
+
+def encontrar_planilhas_com_nao(caminhos, max_workers=8):
+    """
+    Executa 'planilha_tem_nao' em paralelo e retorna os nomes dos
+    arquivos com 'NÃO' nas duas colunas, na ordem de 'caminhos'.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def verificar(caminho):
+        try:
+            return planilha_tem_nao(caminho)
+        except Exception as e:
+            print(f"Erro ao processar planilha {caminho}: {e}")
+            return False
+
+    if not caminhos:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(caminhos))) as executor:
+        resultados = list(executor.map(verificar, caminhos))
+
+    return [os.path.basename(c) for c, tem_nao in zip(caminhos, resultados) if tem_nao]
+
+def carregar_planilha_mestre(caminho_mestre):
+    """
+    Carrega a planilha mestre com as colunas das regras ('mestre') e
+    'Registro' sem zeros à esquerda.
+    """
+    import pandas as pd
 
-    # Carrega a planilha mestre
     try:
         planilha_mestre = pd.read_excel(caminho_mestre, header=None)
-        planilha_mestre.columns = [
-            "Linha", "Turno", "Itinerário", "Registro",
-            "Nome dos Passageiros", "Endereço", "Bairro", "Telefone"
-        ]
+        planilha_mestre.columns = obter_regras().colunas_mestre
         # Remove zeros à esquerda na planilha mestre
         planilha_mestre["Registro"] = (
             planilha_mestre["Registro"]
@@ -189,55 +480,226 @@ def comparar_planilhas(caminho_mestre, caminhos_comparacao):
         )
     except Exception as e:
         raise ValueError(f"Erro ao processar a planilha mestre: {e}")
+    return planilha_mestre
 
-    # Carrega e filtra as planilhas de comparação
-    dfs = []
-    for caminho in caminhos_comparacao:
-        try:
-            df_filtrado = carregar_planilha_e_filtrar(caminho)
-            if df_filtrado.empty:
-                print(f"A planilha {os.path.basename(caminho)} não contém dados válidos após filtragem.")
-                continue
-            if "Registro" not in df_filtrado.columns:
-                print(f"A planilha {os.path.basename(caminho)} não possui coluna 'Reg.' / 'Registro'.")
-                continue
+# Limite de memória (MB) das planilhas de comparação acumuladas antes
+# de passar a gravá-las em disco; None desativa o limite
+LIMITE_MEMORIA_MB = 512
+
+class AcumuladorPlanilhas:
+    """
+    Acumula as planilhas de comparação filtradas sem concatená-las.
 
-            # Remove zeros à esquerda nas planilhas de comparação
-            df_filtrado["Registro"] = (
-                df_filtrado["Registro"]
-                .astype(str)
-                .str.strip()
-                .str.lstrip("0")  # <-- REMOVE zeros à esquerda
+    Os 'Registro' de cada planilha vão para um conjunto de chaves
+    ('chaves'), usado na comparação com a mestre. As linhas completas
+    ficam em memória até somarem 'limite_bytes'; a partir daí são
+    gravadas em Parquet numa pasta temporária e relidas uma planilha
+    por vez em 'planilhas()', junto com o nome do arquivo de origem.
+    """
+
+    def __init__(self, limite_bytes=None):
+        self.limite_bytes = limite_bytes
+        self.chaves = set()
+        self._em_memoria = []
+        self._bytes_em_memoria = 0
+        self._em_disco = []
+        self._pasta = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+    def __len__(self):
+        return len(self._em_memoria) + len(self._em_disco)
+
+    def adicionar(self, df, origem=""):
+        # Remove linhas completamente vazias
+        df = df.dropna(how="all")
+        self.chaves.update(df["Registro"].unique())
+
+        self._em_memoria.append((origem, df))
+        self._bytes_em_memoria += int(df.memory_usage(deep=True).sum())
+        if self.limite_bytes is not None and self._bytes_em_memoria > self.limite_bytes:
+            self._gravar_em_disco()
+
+    def _gravar_em_disco(self):
+        import tempfile
+
+        if self._pasta is None:
+            self._pasta = tempfile.mkdtemp(prefix="comparador_")
+
+        for origem, df in self._em_memoria:
+            caminho = os.path.join(self._pasta, f"{len(self._em_disco):05d}.parquet")
+            colunas = list(df.columns)
+            # Nomes posicionais: as planilhas podem ter colunas repetidas
+            (
+                df.set_axis([str(i) for i in range(len(colunas))], axis=1)
+                .astype("string")
+                .to_parquet(caminho, index=False)
             )
+            self._em_disco.append((origem, caminho, colunas))
 
-            dfs.append(df_filtrado)
-        except ValueError as e:
-            print(f"Erro ao filtrar a planilha {os.path.basename(caminho)}: {e}")
-            continue
-        except Exception as e:
-            print(f"Erro inesperado ao carregar a planilha {os.path.basename(caminho)}: {e}")
-            continue
+        self._em_memoria = []
+        self._bytes_em_memoria = 0
 
-    if not dfs:
-        raise ValueError("Nenhuma planilha válida foi encontrada para comparação.")
+    def planilhas(self):
+        """
+        Percorre as planilhas acumuladas, uma por vez, como (origem, DataFrame).
+        """
+        import pandas as pd
 
-    # Concatena todas as planilhas de comparação
-    try:
-        todas_planilhas = pd.concat(dfs, ignore_index=True, axis=0)
-    except ValueError as e:
-        raise ValueError("Erro ao concatenar as planilhas: " + str(e))
+        for origem, caminho, colunas in self._em_disco:
+            yield origem, pd.read_parquet(caminho).set_axis(colunas, axis=1)
+        yield from self._em_memoria
 
-    # Remove linhas completamente vazias
-    todas_planilhas = todas_planilhas.dropna(how='all')
+    def fechar(self):
+        import shutil
 
-    # Compara somente por 'Registro' (já sem zeros à esquerda)
-    comparacao = planilha_mestre[
-        planilha_mestre["Registro"].isin(todas_planilhas["Registro"])
+        if self._pasta is not None:
+            shutil.rmtree(self._pasta, ignore_errors=True)
+            self._pasta = None
+        self._em_memoria = []
+        self._em_disco = []
+
+def encontrar_conflitos(acumulado):
+    """
+    Descarta as linhas repetidas das planilhas acumuladas, uma planilha
+    por vez, pelo hash de 'Registro' + as colunas de 'conflitos' das
+    regras (normalizados). Linhas sem 'Registro' não entram no
+    relatório. Só as combinações distintas ficam em memória, num
+    dicionário hash -> (valores, arquivos de origem).
+
+    Retorna o relatório de conflitos: registros com valores diferentes
+    entre planilhas, uma linha por combinação de valores, com os
+    arquivos em que ela aparece.
+    """
+    import pandas as pd
+
+    colunas_conflito = obter_regras().colunas_conflito
+    colunas_resultado = ["Registro"] + colunas_conflito + ["Arquivos"]
+
+    combinacoes = {}
+    for origem, df in acumulado.planilhas():
+        registros = df["Registro"]
+        com_registro = registros.notna() & (registros.astype(str).str.strip() != "")
+        df = df[com_registro]
+        if df.empty:
+            continue
+
+        parte = pd.DataFrame({"Registro": df["Registro"].astype(str)})
+        for coluna in colunas_conflito:
+            if coluna in df.columns:
+                valores = df[coluna]
+                parte[coluna] = valores.where(valores.notna(), "").astype(str).str.upper().str.strip()
+            else:
+                parte[coluna] = ""
+
+        hashes = pd.util.hash_pandas_object(parte, index=False)
+        unicos = ~hashes.duplicated()
+        for hash_linha, valores in zip(hashes[unicos], parte[unicos].itertuples(index=False, name=None)):
+            combinacao = combinacoes.get(hash_linha)
+            if combinacao is None:
+                combinacoes[hash_linha] = (valores, [origem])
+            elif origem not in combinacao[1]:
+                combinacao[1].append(origem)
+
+    # Registros com mais de uma combinação de valores
+    por_registro = {}
+    for valores, arquivos in combinacoes.values():
+        por_registro.setdefault(valores[0], []).append(valores + (", ".join(arquivos),))
+
+    linhas = [
+        linha
+        for registro in sorted(por_registro)
+        if len(por_registro[registro]) > 1
+        for linha in por_registro[registro]
     ]
+    return pd.DataFrame(linhas, columns=colunas_resultado)
+
+def selecionar_passageiros(caminho_mestre, caminhos_comparacao, planilha_mestre=None,
+                           limite_memoria_mb=LIMITE_MEMORIA_MB, relatorio_conflitos=None):
+    """
+    Compara a planilha mestre com diversas planilhas de comparação
+    pela coluna 'Registro' (removendo zeros à esquerda para ambas)
+    e retorna as linhas da mestre encontradas, ordenadas por
+    Turno e Itinerário.
+
+    Se 'planilha_mestre' for informada (já carregada com
+    'carregar_planilha_mestre'), o arquivo mestre não é relido.
+    As planilhas de comparação são acumuladas em 'AcumuladorPlanilhas'
+    com até 'limite_memoria_mb' em memória; a comparação usa só o
+    conjunto de 'Registro' delas. Se 'relatorio_conflitos' for uma
+    lista, recebe o relatório de 'encontrar_conflitos'.
+    """
+    if not caminho_mestre or not caminhos_comparacao:
+        raise ValueError("Selecione a planilha mestre e as planilhas para comparação.")
+
+    # Carrega a planilha mestre
+    if planilha_mestre is None:
+        planilha_mestre = carregar_planilha_mestre(caminho_mestre)
+
+    limite_bytes = limite_memoria_mb * 1024 * 1024 if limite_memoria_mb is not None else None
+
+    # Carrega e filtra as planilhas de comparação
+    with AcumuladorPlanilhas(limite_bytes) as acumulado:
+        for caminho in caminhos_comparacao:
+            try:
+                df_filtrado = carregar_planilha_e_filtrar(caminho)
+                if df_filtrado.empty:
+                    print(f"A planilha {os.path.basename(caminho)} não contém dados válidos após filtragem.")
+                    continue
+                if "Registro" not in df_filtrado.columns:
+                    print(f"A planilha {os.path.basename(caminho)} não possui coluna 'Reg.' / 'Registro'.")
+                    continue
+
+                # Remove zeros à esquerda nas planilhas de comparação
+                df_filtrado["Registro"] = (
+                    df_filtrado["Registro"]
+                    .astype(str)
+                    .str.strip()
+                    .str.lstrip("0")  # <-- REMOVE zeros à esquerda
+                )
+            except ValueError as e:
+                print(f"Erro ao filtrar a planilha {os.path.basename(caminho)}: {e}")
+                continue
+            except Exception as e:
+                print(f"Erro inesperado ao carregar a planilha {os.path.basename(caminho)}: {e}")
+                continue
+
+            acumulado.adicionar(df_filtrado, os.path.basename(caminho))
+
+        if not len(acumulado):
+            raise ValueError("Nenhuma planilha válida foi encontrada para comparação.")
+
+        # Aponta registros com valores divergentes entre planilhas;
+        # falha aqui não deve impedir a comparação
+        try:
+            conflitos = encontrar_conflitos(acumulado)
+            if not conflitos.empty:
+                print(f"{conflitos['Registro'].nunique()} registro(s) com valores divergentes entre planilhas.")
+            if relatorio_conflitos is not None:
+                relatorio_conflitos.append(conflitos)
+        except Exception as e:
+            print(f"Erro ao gerar relatório de conflitos: {e}")
+
+        # Compara somente por 'Registro' (já sem zeros à esquerda)
+        comparacao = planilha_mestre[
+            planilha_mestre["Registro"].isin(acumulado.chaves)
+        ]
 
     # Ordena por Turno e Itinerário
     comparacao["Itinerário"] = comparacao["Itinerário"].astype(str)
     comparacao = comparacao.sort_values(by=["Turno", "Itinerário"])
+    return comparacao
+
+def montar_layout_por_turno(comparacao):
+    """
+    Monta o layout final a partir das linhas selecionadas da mestre,
+    separando por turno e itinerário.
+    """
+    import pandas as pd
 
     # Cria o layout final, separando por turno e itinerário
     separada_por_turnos = []
@@ -254,7 +716,7 @@ def comparar_planilhas(caminho_mestre, caminhos_comparacao):
         # Para cada itinerário dentro do turno
         for itinerario, grupo_itinerario in grupo_turno.groupby("Itinerário"):
             # Cabeçalho
-            cabecalho_df = pd.DataFrame([planilha_mestre.columns], columns=planilha_mestre.columns)
+            cabecalho_df = pd.DataFrame([comparacao.columns], columns=comparacao.columns)
             separada_por_turnos.append(cabecalho_df)
 
             # Dados do itinerário
@@ -267,31 +729,39 @@ def comparar_planilhas(caminho_mestre, caminhos_comparacao):
     planilha_final = pd.concat(separada_por_turnos, ignore_index=True)
     return planilha_final
 
-def gerar_nome_sheet_com_data():
+def comparar_planilhas(caminho_mestre, caminhos_comparacao):
+    """
+    Compara a planilha mestre com diversas planilhas de comparação
+    pela coluna 'Registro' (removendo zeros à esquerda para ambas).
+    """
+    comparacao = selecionar_passageiros(caminho_mestre, caminhos_comparacao)
+    return montar_layout_por_turno(comparacao)
+
+def gerar_nome_sheet_com_data(data_referencia=None):
     """
     Gera o nome da aba (sheet) no formato dd.mm,
-    por exemplo: '10.03'.
+    por exemplo: '10.03'. Usa a data atual se
+    'data_referencia' não for informada.
     """
-    data_atual = datetime.now()
+    data_atual = data_referencia or datetime.now()
     return data_atual.strftime("%d.%m")
 
-def salvar_planilha_com_estilo(planilha, caminho_saida):
+def salvar_planilha_com_estilo(planilha, caminho_saida, data_referencia=None):
     """
     Salva o DataFrame 'planilha' em um arquivo Excel,
     aplicando estilos e formatação com openpyxl.
     """
     from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, Border, Side
 
     wb = Workbook()
     ws = wb.active
 
-    nome_sheet = gerar_nome_sheet_com_data()
+    nome_sheet = gerar_nome_sheet_com_data(data_referencia)
     ws.title = nome_sheet
 
-    estilo_amarelo = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-    estilo_azul_claro = PatternFill(start_color="ADD8E6", end_color="ADD8E6", fill_type="solid")
-    estilo_laranja = PatternFill(start_color="FFA500", end_color="FFA500", fill_type="solid")
-    estilo_verde_claro = PatternFill(start_color="0cff00", end_color="0cff00", fill_type="solid")  # Novo estilo verde claro
+    regras = obter_regras()
+    estilo_laranja = regras.preenchimento_turno
     estilo_negrito = Font(bold=True)
     centralizado = Alignment(horizontal="center", vertical="center")
 
@@ -302,15 +772,21 @@ def salvar_planilha_com_estilo(planilha, caminho_saida):
         right=Side(border_style="thin", color="000000")
     )
 
+    # Estilos pré-calculados: preenchimento do cabeçalho por coluna,
+    # nomes do cabeçalho e células destacadas pelas regras
+    preenchimento_cabecalho = [regras.preenchimento_cabecalho(col) for col in planilha.columns]
+    nomes_cabecalho = {str(col).upper().strip() for col in planilha.columns}
+    destaques = {}
+    for posicao, mascara, preenchimento in reversed(regras.mascaras_destaque(planilha)):
+        for indice in mascara.nonzero()[0]:
+            destaques[(int(indice), posicao)] = preenchimento
+
     # Cabeçalho (primeira linha)
     for col_num, col_name in enumerate(planilha.columns, 1):
         cell = ws.cell(row=1, column=col_num, value=col_name)
         cell.font = estilo_negrito
         cell.alignment = centralizado
-        if col_name in ["Linha", "Turno", "Itinerário", "Registro"]:
-            cell.fill = estilo_amarelo
-        else:
-            cell.fill = estilo_azul_claro
+        cell.fill = preenchimento_cabecalho[col_num - 1]
         cell.border = border_style
 
     # Demais linhas
@@ -328,13 +804,10 @@ def salvar_planilha_com_estilo(planilha, caminho_saida):
                 cell.alignment = centralizado
             else:
                 # Se for linha de cabeçalho repetida
-                if str(value).upper().strip() in [str(col).upper().strip() for col in planilha.columns]:
+                if str(value).upper().strip() in nomes_cabecalho:
                     cell.font = estilo_negrito
                     # Preenchimento de acordo com a coluna
-                    if planilha.columns[col_num - 1] in ["Linha", "Turno", "Itinerário", "Registro"]:
-                        cell.fill = estilo_amarelo
-                    else:
-                        cell.fill = estilo_azul_claro
+                    cell.fill = preenchimento_cabecalho[col_num - 1]
                     cell.alignment = centralizado
                 else:
                     cell.alignment = centralizado
@@ -343,31 +816,986 @@ def salvar_planilha_com_estilo(planilha, caminho_saida):
             if not linha_vazia:
                 cell.border = border_style
 
-            # Verifica se a coluna é "Bairro" e se o valor termina com "Jac." ou "Jacareí"
-            if planilha.columns[col_num - 1] == "Bairro" and isinstance(value, str):
-                if value.strip().endswith("Jac.") or value.strip().endswith("Jacareí"):
-                    cell.fill = estilo_verde_claro
+            # Destaques das regras (ex.: Bairro terminando em "Jac." ou "Jacareí")
+            destaque = destaques.get((row_num - 2, col_num - 1))
+            if destaque is not None:
+                cell.fill = destaque
 
     wb.save(caminho_saida)
 
-def gerar_nome_arquivo_sugerido():
+def salvar_planilha_condicional(planilha, caminho_saida, data_referencia=None):
+    """
+    Salva o DataFrame 'planilha' com o mesmo visual de
+    'salvar_planilha_com_estilo', mas expressando as regras de estilo
+    como formatação condicional sobre intervalos (cabeçalhos, linhas de
+    turno, bordas e destaques das regras). Só o alinhamento, que o Excel
+    não aceita em formatação condicional, continua sendo aplicado por
+    célula, e apenas nas células preenchidas.
+    """
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, Border, Side
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.formatting.rule import FormulaRule
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(gerar_nome_sheet_com_data(data_referencia))
+
+    colunas = list(planilha.columns)
+    ultima_coluna = get_column_letter(len(colunas))
+    ultima_linha = len(planilha) + 1
+    centralizado = Alignment(horizontal="center", vertical="center")
+
+    def celula(valor):
+        if valor is None or valor == "":
+            return None
+        cell = WriteOnlyCell(ws, value=valor)
+        cell.alignment = centralizado
+        return cell
+
+    regras = obter_regras()
+
+    # Regras de formatação (a primeira adicionada tem maior prioridade)
+    for coluna, _, formula_excel, preenchimento in regras.destaques:
+        if coluna not in colunas:
+            continue
+        letra = get_column_letter(colunas.index(coluna) + 1)
+        ws.conditional_formatting.add(
+            f"{letra}1:{letra}{ultima_linha}",
+            FormulaRule(formula=[formula_excel(letra)], fill=preenchimento)
+        )
+
+    if "Turno" in colunas:
+        letra = get_column_letter(colunas.index("Turno") + 1)
+        ws.conditional_formatting.add(
+            f"A1:{ultima_coluna}{ultima_linha}",
+            FormulaRule(
+                formula=[f'LEFT(${letra}1,6)="Turno:"'],
+                fill=regras.preenchimento_turno,
+                font=Font(bold=True)
+            )
+        )
+
+    # Cabeçalho (primeira linha e repetições): célula igual ao nome da coluna
+    for col_num, col_name in enumerate(colunas, 1):
+        letra = get_column_letter(col_num)
+        ws.conditional_formatting.add(
+            f"{letra}1:{letra}{ultima_linha}",
+            FormulaRule(
+                formula=[f"{letra}1={letra}$1"],
+                fill=regras.preenchimento_cabecalho(col_name),
+                font=Font(bold=True)
+            )
+        )
+
+    # Borda somente em linhas que não são completamente vazias
+    lado = Side(border_style="thin", color="000000")
+    ws.conditional_formatting.add(
+        f"A1:{ultima_coluna}{ultima_linha}",
+        FormulaRule(
+            formula=[f"COUNTA($A1:${ultima_coluna}1)>0"],
+            border=Border(top=lado, bottom=lado, left=lado, right=lado)
+        )
+    )
+
+    ws.append([celula(col_name) for col_name in colunas])
+    for row in planilha.itertuples(index=False, name=None):
+        ws.append([celula(value) for value in row])
+
+    wb.save(caminho_saida)
+
+# Escritores disponíveis para o arquivo de saída
+ESCRITORES = {
+    "estilo": salvar_planilha_com_estilo,
+    "condicional": salvar_planilha_condicional,
+}
+MODO_ESCRITA = "estilo"
+
+def salvar_resultado(planilha, caminho_saida, modo=None, data_referencia=None):
+    """
+    Salva o resultado com o escritor do modo informado
+    (ou 'MODO_ESCRITA', se nenhum for passado).
+    """
+    ESCRITORES[modo or MODO_ESCRITA](planilha, caminho_saida, data_referencia)
+
+def medir_escritores(planilha):
+    """
+    Grava 'planilha' com cada escritor em uma pasta temporária e
+    retorna, por modo, o tamanho do arquivo (bytes) e o tempo de
+    gravação (segundos).
+    """
+    import tempfile
+    import time
+
+    resultados = {}
+    with tempfile.TemporaryDirectory() as pasta:
+        for modo, escritor in ESCRITORES.items():
+            caminho = os.path.join(pasta, f"{modo}.xlsx")
+            inicio = time.perf_counter()
+            escritor(planilha, caminho)
+            resultados[modo] = {
+                "bytes": os.path.getsize(caminho),
+                "segundos": time.perf_counter() - inicio,
+            }
+    return resultados
+
+def gerar_nome_arquivo_sugerido(reservados=None):
+    """
+    Próximo nome livre 'AAAA-MM-DD.NN.xlsx' em 'Viagens do dia'.
+    'reservados' são nomes já prometidos a execuções em andamento.
+    """
     pasta_destino = r"C:/Comparador de Planilhas/Viagens do dia/"
     data_hoje = datetime.now().strftime("%Y-%m-%d")
 
-    # Lista arquivos existentes para essa data
-    arquivos_existentes = [f for f in os.listdir(pasta_destino) if f.startswith(data_hoje) and f.endswith(".xlsx")]
-
-    numero = 1
-    while True:
-        sufixo = f".{numero:02d}"
-        nome_arquivo = f"{data_hoje}{sufixo}.xlsx"
-        if nome_arquivo not in arquivos_existentes:
-            break
-        numero += 1
+    # Lista arquivos existentes uma única vez
+    arquivos_existentes = listar_nomes(pasta_destino) | set(reservados or ())
+    nome_arquivo = reservar_nome_unico(
+        arquivos_existentes, lambda numero: f"{data_hoje}.{numero:02d}.xlsx"
+    )
 
     caminho_final = os.path.join(pasta_destino, nome_arquivo)
     return caminho_final
 
+# ===============================
+#  OPERAÇÕES DE ARQUIVO
+# ===============================
+
+def listar_nomes(diretorio):
+    """
+    Retorna o conjunto de nomes (normalizados para comparação no
+    sistema de arquivos) presentes em 'diretorio'.
+    """
+    if not os.path.isdir(diretorio):
+        return set()
+    return {os.path.normcase(nome) for nome in os.listdir(diretorio)}
+
+def reservar_nome_unico(existentes, gerar_nome, inicio=1):
+    """
+    Gera nomes com 'gerar_nome(numero)', a partir de 'inicio', até
+    achar um que não esteja em 'existentes'. O nome escolhido é
+    adicionado ao conjunto, para que chamadas seguintes não o repitam.
+    """
+    numero = inicio
+    while os.path.normcase(gerar_nome(numero)) in existentes:
+        numero += 1
+    nome = gerar_nome(numero)
+    existentes.add(os.path.normcase(nome))
+    return nome
+
+def gerar_caminho_backup_mestre(caminho_mestre, diretorio_backup):
+    """
+    Caminho livre para o backup do dia da planilha mestre:
+    'Planilha Mestre AAAA-MM-DD.NN<extensão>'.
+    """
+    data_hoje = datetime.now().strftime("%Y-%m-%d")
+    extensao = os.path.splitext(caminho_mestre)[1]
+    nome_backup = reservar_nome_unico(
+        listar_nomes(diretorio_backup),
+        lambda numero: f"Planilha Mestre {data_hoje}.{numero:02d}{extensao}"
+    )
+    return os.path.join(diretorio_backup, nome_backup)
+
+def destinos_processados(caminhos, diretorio_processado):
+    """
+    Define, com uma única leitura do diretório, o destino de cada
+    planilha em 'diretorio_processado'. Em caso de nome repetido,
+    acrescenta '_01', '_02', ... antes da extensão.
+    """
+    existentes = listar_nomes(diretorio_processado)
+    destinos = []
+    for caminho in caminhos:
+        base, extensao = os.path.splitext(os.path.basename(caminho))
+        nome = reservar_nome_unico(
+            existentes,
+            lambda numero: f"{base}{extensao}" if numero == 0 else f"{base}_{numero:02d}{extensao}",
+            inicio=0
+        )
+        destinos.append(os.path.join(diretorio_processado, nome))
+    return destinos
+
+def salvar_e_mover_transacional(planilha, caminho_saida, caminhos_origem,
+                                diretorio_processado, modo=None, max_workers=8):
+    """
+    Salva o resultado em 'caminho_saida' e move as planilhas de origem
+    para 'diretorio_processado' como uma única operação.
+
+    A gravação (em um arquivo temporário) e as movimentações rodam em
+    paralelo. Se qualquer etapa falhar, as planilhas já movidas voltam
+    para a origem, o temporário é apagado e o erro é repassado. Só
+    quando tudo dá certo o temporário é renomeado para 'caminho_saida'.
+
+    Retorna a lista de destinos das planilhas movidas.
+    """
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+
+    os.makedirs(os.path.dirname(caminho_saida), exist_ok=True)
+    os.makedirs(diretorio_processado, exist_ok=True)
+
+    destinos = destinos_processados(caminhos_origem, diretorio_processado)
+    pasta, nome = os.path.split(caminho_saida)
+    caminho_temporario = os.path.join(pasta, f"~{nome}")
+    movidos = []
+
+    def mover(origem, destino):
+        shutil.move(origem, destino)
+        movidos.append((origem, destino))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            tarefas = [executor.submit(salvar_resultado, planilha, caminho_temporario, modo)]
+            tarefas += [
+                executor.submit(mover, origem, destino)
+                for origem, destino in zip(caminhos_origem, destinos)
+            ]
+        for tarefa in tarefas:
+            tarefa.result()
+
+        os.replace(caminho_temporario, caminho_saida)
+    except Exception:
+        # Desfaz as movimentações concluídas
+        for origem, destino in reversed(movidos):
+            try:
+                shutil.move(destino, origem)
+            except Exception as e:
+                print(f"Erro ao devolver {os.path.basename(destino)} para a origem: {e}")
+        if os.path.exists(caminho_temporario):
+            os.remove(caminho_temporario)
+        raise
+
+    return destinos
+
+DIRETORIO_CONFLITOS = r"C:/Comparador de Planilhas/Conflitos/"
+
+def executar_comparacao(caminho_mestre, caminhos_comparacao, diretorio_processado,
+                        caminho_saida=None, modo=None, **opcoes_selecao):
+    """
+    Fluxo completo de uma comparação: seleciona os passageiros, monta
+    o layout, salva o resultado e move as planilhas de origem para a
+    pasta da execução ('diretorio_processado/AAAA-MM-DD/NN', com a data
+    e o número do arquivo de saída; transacional) e grava o histórico
+    e, se houver, o relatório de conflitos em 'DIRETORIO_CONFLITOS'.
+    'opcoes_selecao' são repassadas a 'selecionar_passageiros'.
+    Retorna o caminho do arquivo gerado.
+    """
+    # Versão da mestre usada, para o reprocessamento achar o backup certo
+    info_mestre = os.stat(caminho_mestre)
+
+    conflitos = []
+    comparacao = selecionar_passageiros(
+        caminho_mestre, caminhos_comparacao, relatorio_conflitos=conflitos, **opcoes_selecao
+    )
+    df_resultado = montar_layout_por_turno(comparacao)
+
+    caminho_saida = caminho_saida or gerar_nome_arquivo_sugerido()
+
+    # Salva o resultado e move as planilhas de origem (tudo ou nada);
+    # a pasta da execução identifica a data e o número para o reprocessamento
+    try:
+        data, numero = identificar_execucao(caminho_saida)
+        diretorio_execucao = os.path.join(diretorio_processado, data, f"{numero:02d}")
+    except ValueError:
+        diretorio_execucao = os.path.join(diretorio_processado, datetime.now().strftime("%Y-%m-%d"))
+    salvar_e_mover_transacional(
+        df_resultado, caminho_saida, caminhos_comparacao, diretorio_execucao, modo
+    )
+
+    try:
+        registrar_arquivamento(diretorio_execucao, caminho_saida, caminho_mestre, info_mestre)
+    except Exception as e:
+        print(f"Erro ao registrar a mestre da execução: {e}")
+
+    # Histórico: falha aqui não deve impedir a entrega do arquivo
+    try:
+        registrar_execucao(comparacao, caminho_saida)
+    except Exception as e:
+        print(f"Erro ao gravar histórico da execução: {e}")
+
+    # Relatório de conflitos com o mesmo nome do resultado, em outra pasta
+    if conflitos and not conflitos[0].empty:
+        try:
+            os.makedirs(DIRETORIO_CONFLITOS, exist_ok=True)
+            conflitos[0].to_excel(
+                os.path.join(DIRETORIO_CONFLITOS, os.path.basename(caminho_saida)), index=False
+            )
+        except Exception as e:
+            print(f"Erro ao gravar relatório de conflitos: {e}")
+
+    return caminho_saida
+
+# ===============================
+#  HISTÓRICO DE EXECUÇÕES
+# ===============================
+
+# Cada execução fica em <DIRETORIO_HISTORICO>/data=AAAA-MM-DD/execucao=NN/resultado.parquet
+DIRETORIO_HISTORICO = r"C:/Comparador de Planilhas/Historico/"
+
+def identificar_execucao(nome):
+    """
+    Converte o nome de um arquivo de saída ('2025-03-10.02.xlsx')
+    ou de uma execução ('2025-03-10.02') em (data, número).
+    """
+    nome = os.path.basename(nome)
+    if nome.lower().endswith(".xlsx"):
+        nome = nome[:-len(".xlsx")]
+    try:
+        data, numero = nome.rsplit(".", 1)
+        datetime.strptime(data, "%Y-%m-%d")
+        return data, int(numero)
+    except ValueError:
+        raise ValueError(f"Execução inválida: '{nome}' (esperado AAAA-MM-DD.NN).")
+
+def _caminho_particao(data, numero, diretorio=DIRETORIO_HISTORICO):
+    return os.path.join(diretorio, f"data={data}", f"execucao={numero:02d}", "resultado.parquet")
+
+def registrar_execucao(comparacao, caminho_saida, diretorio=DIRETORIO_HISTORICO):
+    """
+    Grava as linhas selecionadas da mestre ('selecionar_passageiros')
+    no histórico, na partição da data e número do arquivo de saída.
+    """
+    data, numero = identificar_execucao(caminho_saida)
+    caminho = _caminho_particao(data, numero, diretorio)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+
+    # Tudo como texto, para o esquema ser o mesmo em todas as execuções
+    comparacao.fillna("").astype(str).to_parquet(caminho, index=False)
+    return caminho
+
+def listar_execucoes(data=None, diretorio=DIRETORIO_HISTORICO):
+    """
+    Lista as execuções gravadas no histórico como (data, número),
+    opcionalmente só as de uma data.
+    """
+    if not os.path.isdir(diretorio):
+        return []
+
+    execucoes = []
+    for pasta_data in os.listdir(diretorio):
+        if not pasta_data.startswith("data="):
+            continue
+        data_particao = pasta_data[len("data="):]
+        if data and data_particao != data:
+            continue
+        for pasta_execucao in os.listdir(os.path.join(diretorio, pasta_data)):
+            if pasta_execucao.startswith("execucao="):
+                execucoes.append((data_particao, int(pasta_execucao[len("execucao="):])))
+    return sorted(execucoes)
+
+def carregar_execucao(data, numero, colunas=None, diretorio=DIRETORIO_HISTORICO):
+    """
+    Lê uma única partição do histórico.
+    """
+    import pandas as pd
+
+    caminho = _caminho_particao(data, numero, diretorio)
+    if not os.path.exists(caminho):
+        raise FileNotFoundError(f"Execução {data}.{numero:02d} não encontrada no histórico.")
+    return pd.read_parquet(caminho, columns=colunas)
+
+def _chaves_delta(df):
+    """
+    Chave de cada linha para o delta: ('Registro', ocorrência). Um
+    'Registro' repetido (ex.: passageiro em dois itinerários) tem as
+    linhas numeradas na ordem de Linha e Itinerário.
+    """
+    import pandas as pd
+
+    ordem = ["Registro"] + [c for c in ("Linha", "Itinerário") if c in df.columns]
+    ocorrencia = (
+        df.sort_values(ordem, kind="stable")
+        .groupby("Registro")
+        .cumcount()
+        .reindex(df.index)
+    )
+    return pd.MultiIndex.from_arrays([df["Registro"], ocorrencia], names=["Registro", "Ocorrência"])
+
+def calcular_delta(execucao_antes, execucao_depois, diretorio=DIRETORIO_HISTORICO):
+    """
+    Compara duas execuções do histórico (cada uma como (data, número))
+    e retorna um dicionário com:
+    - 'adicionados': passageiros presentes só na segunda
+    - 'removidos': passageiros presentes só na primeira
+    - 'alterados': mesmo 'Registro' com outros dados diferentes,
+      com os valores anteriores nas colunas '(antes)'
+
+    Todas as linhas de um 'Registro' repetido são comparadas: elas são
+    pareadas na ordem de Linha e Itinerário, e as que sobram de um dos
+    lados entram em 'adicionados' ou 'removidos'.
+    """
+    import pandas as pd
+
+    antes = carregar_execucao(*execucao_antes, diretorio=diretorio)
+    depois = carregar_execucao(*execucao_depois, diretorio=diretorio)
+
+    chaves_antes = _chaves_delta(antes)
+    chaves_depois = _chaves_delta(depois)
+
+    adicionados = depois[~chaves_depois.isin(chaves_antes)]
+    removidos = antes[~chaves_antes.isin(chaves_depois)]
+
+    colunas = [c for c in antes.columns if c in depois.columns and c != "Registro"]
+    antes_idx = antes[colunas].set_axis(chaves_antes)
+    depois_idx = depois[colunas].set_axis(chaves_depois)
+    comuns = antes_idx.index.intersection(depois_idx.index)
+    antes_idx = antes_idx.loc[comuns]
+    depois_idx = depois_idx.loc[comuns]
+
+    diferencas = antes_idx != depois_idx
+    mascara = diferencas.any(axis=1)
+    alterados = depois_idx[mascara].join(antes_idx[mascara].add_suffix(" (antes)"))
+    alterados["Campos alterados"] = (
+        diferencas[mascara].dot(pd.Index(colunas) + ", ").str.rstrip(", ")
+    )
+
+    return {
+        "adicionados": adicionados.reset_index(drop=True),
+        "removidos": removidos.reset_index(drop=True),
+        "alterados": alterados.reset_index().drop(columns="Ocorrência"),
+    }
+
+# ===============================
+#  REPROCESSAMENTO (BACKFILL)
+# ===============================
+
+DIRETORIO_MESTRE = r"C:/Comparador de Planilhas/Masterdata/"
+DIRETORIO_COMPARACAO = r"C:/Comparador de Planilhas/Extras Planilhas/"
+DIRETORIO_PROCESSADO = r"C:/Comparador de Planilhas/Extras Planilhas Processadas/"
+DIRETORIO_BACKUP = r"C:/Comparador de Planilhas/Backup/"
+DIRETORIO_REPROCESSADAS = r"C:/Comparador de Planilhas/Viagens do dia/Reprocessadas/"
+
+# Arquivo gravado na pasta de cada execução arquivada
+ARQUIVO_EXECUCAO = "execucao.json"
+
+def registrar_arquivamento(diretorio_execucao, caminho_saida, caminho_mestre, info_mestre):
+    """
+    Grava em 'diretorio_execucao' o arquivo de saída e a versão da
+    mestre (tamanho e data de modificação) usados na execução.
+    """
+    import json
+
+    registro = {
+        "saida": os.path.basename(caminho_saida),
+        "mestre": os.path.abspath(caminho_mestre),
+        "mestre_bytes": info_mestre.st_size,
+        "mestre_modificacao": info_mestre.st_mtime,
+    }
+    with open(os.path.join(diretorio_execucao, ARQUIVO_EXECUCAO), "w", encoding="utf-8") as arquivo:
+        json.dump(registro, arquivo, ensure_ascii=False)
+
+def _ler_data(texto):
+    for formato in ("%Y-%m-%d", "%d.%m.%Y", "%d-%m-%Y"):
+        try:
+            return datetime.strptime(texto, formato).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+def _execucao_do_caminho(caminho, diretorio_base):
+    """
+    (data, número) de um arquivo arquivado: a primeira pasta (abaixo de
+    'diretorio_base') com nome de data e, se houver, a subpasta 'NN'
+    da execução. Para arquivos movidos antes das pastas de execução, o
+    número é None e, sem pasta de data, vale a data de modificação.
+    """
+    partes = os.path.relpath(os.path.dirname(caminho), diretorio_base).split(os.sep)
+    for i, parte in enumerate(partes):
+        data = _ler_data(parte)
+        if data:
+            seguinte = partes[i + 1] if i + 1 < len(partes) else ""
+            return data, int(seguinte) if seguinte.isdigit() else None
+    return datetime.fromtimestamp(os.path.getmtime(caminho)).strftime("%Y-%m-%d"), None
+
+def _ordem_execucao(execucao):
+    data, numero = execucao
+    return data, -1 if numero is None else numero
+
+def agrupar_arquivados_por_execucao(diretorio_processado=DIRETORIO_PROCESSADO):
+    """
+    Agrupa as planilhas de comparação arquivadas por execução
+    ((AAAA-MM-DD, número ou None)), em ordem cronológica.
+    """
+    grupos = {}
+    for pasta, _, arquivos in os.walk(diretorio_processado):
+        for arq in arquivos:
+            if arq.startswith("~") or not arq.lower().endswith(('.xls', '.xlsx', '.xlsb')):
+                continue
+            caminho = os.path.join(pasta, arq)
+            grupos.setdefault(_execucao_do_caminho(caminho, diretorio_processado), []).append(caminho)
+    return {
+        execucao: sorted(grupos[execucao])
+        for execucao in sorted(grupos, key=_ordem_execucao)
+    }
+
+def _ler_arquivamento(caminhos):
+    """
+    Registro da execução ('registrar_arquivamento') na pasta das
+    planilhas, ou None se não houver.
+    """
+    import json
+
+    caminho = os.path.join(os.path.dirname(caminhos[0]), ARQUIVO_EXECUCAO)
+    try:
+        with open(caminho, encoding="utf-8") as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError):
+        return None
+
+def listar_backups_mestre(diretorio_backup=DIRETORIO_BACKUP):
+    """
+    Lista os backups criados por 'selecionar_mestre' como
+    (data, número, caminho), em ordem cronológica.
+    """
+    import re
+
+    padrao = re.compile(r"^Planilha Mestre (\d{4}-\d{2}-\d{2})\.(\d{2,})\.(xls|xlsx|xlsb)$", re.IGNORECASE)
+    if not os.path.isdir(diretorio_backup):
+        return []
+
+    backups = []
+    for arq in os.listdir(diretorio_backup):
+        encontrado = padrao.match(arq)
+        if encontrado:
+            backups.append((encontrado.group(1), int(encontrado.group(2)), os.path.join(diretorio_backup, arq)))
+    return sorted(backups)
+
+def mestre_para_data(backups, data):
+    """
+    Escolhe o backup da mestre válido para 'data': o último do
+    próprio dia ou, se não houver, o último anterior a ele.
+    """
+    candidatos = [b for b in backups if b[0] <= data]
+    if not candidatos:
+        raise FileNotFoundError(f"Nenhum backup da planilha mestre até {data}.")
+    return candidatos[-1][2]
+
+def mestre_para_execucao(backups, data, registro=None):
+    """
+    Escolhe o backup da mestre usada numa execução: o último, até
+    'data', com o tamanho e a data de modificação gravados em
+    'registro' (o backup é uma cópia com 'copy2', que preserva a data).
+    Sem registro, ou sem backup correspondente, usa 'mestre_para_data'.
+    """
+    if registro:
+        for data_backup, _, caminho in reversed(backups):
+            if data_backup > data:
+                continue
+            try:
+                info = os.stat(caminho)
+            except OSError:
+                continue
+            if (info.st_size == registro.get("mestre_bytes")
+                    and abs(info.st_mtime - registro.get("mestre_modificacao", 0)) <= 2):
+                return caminho
+    return mestre_para_data(backups, data)
+
+# Mestres carregadas, recebidas uma vez por processo de reprocessamento
+_MESTRES_CARREGADAS = {}
+
+def _iniciar_reprocessamento(mestres):
+    _MESTRES_CARREGADAS.update(mestres)
+
+def _reprocessar_execucao(data, caminho_mestre, caminhos, caminho_saida, modo):
+    comparacao = selecionar_passageiros(
+        caminho_mestre, caminhos, planilha_mestre=_MESTRES_CARREGADAS[caminho_mestre].copy()
+    )
+    salvar_resultado(
+        montar_layout_por_turno(comparacao), caminho_saida, modo,
+        data_referencia=datetime.strptime(data, "%Y-%m-%d")
+    )
+    return caminho_saida
+
+def _nome_execucao(execucao):
+    data, numero = execucao
+    return data if numero is None else f"{data}.{numero:02d}"
+
+def reprocessar_periodo(data_inicial=None, data_final=None,
+                        diretorio_processado=DIRETORIO_PROCESSADO,
+                        diretorio_backup=DIRETORIO_BACKUP,
+                        diretorio_saida=DIRETORIO_REPROCESSADAS,
+                        modo=None, max_workers=None):
+    """
+    Regera os relatórios a partir das planilhas arquivadas, um por
+    execução original.
+
+    Cada execução (opcionalmente limitada a [data_inicial, data_final],
+    no formato AAAA-MM-DD) é pareada com o backup da mestre que ela
+    usou ('mestre_para_execucao'). Cada mestre distinta é carregada uma
+    única vez e as execuções são processadas em paralelo, gerando
+    '<data>.<NN da execução>.xlsx' em 'diretorio_saida' (arquivos
+    arquivados sem pasta de execução são reunidos por data, em
+    '<data>.NN.xlsx'). Retorna {'AAAA-MM-DD.NN' ou data: caminho
+    gerado}; execuções com erro são informadas e puladas.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    grupos = {
+        execucao: caminhos
+        for execucao, caminhos in agrupar_arquivados_por_execucao(diretorio_processado).items()
+        if (not data_inicial or execucao[0] >= data_inicial)
+        and (not data_final or execucao[0] <= data_final)
+    }
+    if not grupos:
+        raise FileNotFoundError("Nenhuma planilha arquivada encontrada no período.")
+
+    backups = listar_backups_mestre(diretorio_backup)
+    tarefas = {}
+    for execucao, caminhos in grupos.items():
+        try:
+            caminho_mestre = mestre_para_execucao(backups, execucao[0], _ler_arquivamento(caminhos))
+            tarefas[execucao] = (caminho_mestre, caminhos)
+        except FileNotFoundError as e:
+            print(f"Execução {_nome_execucao(execucao)} ignorada: {e}")
+
+    mestres = {
+        caminho_mestre: carregar_planilha_mestre(caminho_mestre)
+        for caminho_mestre in {mestre for mestre, _ in tarefas.values()}
+    }
+
+    # Nomes de saída definidos antes, com uma única leitura do diretório;
+    # primeiro os das execuções numeradas, que mantêm o próprio número
+    os.makedirs(diretorio_saida, exist_ok=True)
+    existentes = listar_nomes(diretorio_saida)
+    saidas = {}
+    for execucao in sorted(tarefas, key=lambda e: e[1] is None):
+        data, numero = execucao
+        if numero is None:
+            gerar_nome = lambda n, data=data: f"{data}.{n:02d}.xlsx"
+            inicio = 1
+        else:
+            gerar_nome = lambda n, nome=_nome_execucao(execucao): (
+                f"{nome}.xlsx" if n == 0 else f"{nome}_{n:02d}.xlsx"
+            )
+            inicio = 0
+        saidas[execucao] = os.path.join(
+            diretorio_saida, reservar_nome_unico(existentes, gerar_nome, inicio=inicio)
+        )
+
+    gerados = {}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_iniciar_reprocessamento,
+                             initargs=(mestres,)) as executor:
+        futuros = {
+            execucao: executor.submit(
+                _reprocessar_execucao, execucao[0], caminho_mestre, caminhos, saidas[execucao], modo
+            )
+            for execucao, (caminho_mestre, caminhos) in tarefas.items()
+        }
+        for execucao, futuro in futuros.items():
+            try:
+                gerados[_nome_execucao(execucao)] = futuro.result()
+            except Exception as e:
+                print(f"Erro ao reprocessar {_nome_execucao(execucao)}: {e}")
+
+    return gerados
+
+# ===============================
+#  SERVIÇO LOCAL
+# ===============================
+
+# O serviço só escuta no loopback
+SERVICO_PORTA = 8765
+SERVICO_URL = f"http://127.0.0.1:{SERVICO_PORTA}"
+
+class CacheArquivos:
+    """
+    Cache em memória do resultado de 'carregar(caminho)', descartado
+    quando o arquivo muda (data de modificação ou tamanho).
+    """
+
+    def __init__(self, carregar):
+        import threading
+
+        self.carregar = carregar
+        self._itens = {}
+        self._travas = {}
+        self._trava = threading.Lock()
+
+    @staticmethod
+    def _chave(caminho):
+        return os.path.normcase(os.path.abspath(caminho))
+
+    @staticmethod
+    def _assinatura(caminho):
+        info = os.stat(caminho)
+        return info.st_mtime_ns, info.st_size
+
+    def obter(self, caminho):
+        import threading
+
+        chave = self._chave(caminho)
+        with self._trava:
+            trava_arquivo = self._travas.setdefault(chave, threading.Lock())
+
+        # Um mesmo arquivo é carregado por um job de cada vez
+        with trava_arquivo:
+            try:
+                assinatura = self._assinatura(caminho)
+            except OSError:
+                # Arquivo removido ou inacessível: não guarda mais nada dele
+                self.descartar(caminho)
+                raise
+
+            item = self._itens.get(chave)
+            if item is not None and item[0] == assinatura:
+                return item[1].copy()
+
+            df = self.carregar(caminho)
+            self._itens[chave] = (assinatura, df)
+            return df.copy()
+
+    def descartar(self, caminho):
+        chave = self._chave(caminho)
+        with self._trava:
+            self._itens.pop(chave, None)
+            self._travas.pop(chave, None)
+
+# Tempo (segundos) que um job concluído ou com erro continua consultável
+SERVICO_VALIDADE_JOBS = 60 * 60
+
+def _dentro_de(caminho, diretorio):
+    """
+    Indica se 'caminho' (após resolver links e '..') fica em 'diretorio'.
+    """
+    caminho = os.path.normcase(os.path.realpath(caminho))
+    diretorio = os.path.normcase(os.path.realpath(diretorio))
+    try:
+        return os.path.commonpath([caminho, diretorio]) == diretorio
+    except ValueError:
+        # Unidades diferentes no Windows
+        return False
+
+class ServicoComparacao:
+    """
+    Executa comparações em uma fila de jobs, mantendo as planilhas
+    mestre já carregadas em memória entre os jobs. Só aceita a mestre
+    de 'diretorio_mestre' e planilhas de 'diretorio_comparacao', e as
+    move sempre para 'diretorio_processado', definido aqui e não pelo
+    cliente.
+    """
+
+    def __init__(self, max_workers=4, diretorio_mestre=DIRETORIO_MESTRE,
+                 diretorio_comparacao=DIRETORIO_COMPARACAO,
+                 diretorio_processado=DIRETORIO_PROCESSADO,
+                 validade_jobs=SERVICO_VALIDADE_JOBS):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.mestres = CacheArquivos(carregar_planilha_mestre)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.diretorio_mestre = diretorio_mestre
+        self.diretorio_comparacao = diretorio_comparacao
+        self.diretorio_processado = diretorio_processado
+        self.validade_jobs = validade_jobs
+        self.jobs = {}
+        self._nomes_reservados = set()
+        self._trava = threading.Lock()
+
+    def enviar(self, pedido):
+        """
+        Enfileira um pedido ({'mestre', 'planilhas', 'modo'?}) e
+        retorna o id do job.
+        """
+        import uuid
+
+        if not isinstance(pedido, dict):
+            raise ValueError("O pedido deve ser um objeto JSON.")
+        if not pedido.get("mestre") or not pedido.get("planilhas"):
+            raise ValueError("Selecione a planilha mestre e as planilhas para comparação.")
+        if not isinstance(pedido["mestre"], str):
+            raise ValueError("'mestre' deve ser um caminho.")
+        self._validar_planilhas(pedido["planilhas"])
+        if not _dentro_de(pedido["mestre"], self.diretorio_mestre):
+            raise PermissionError(f"A planilha mestre deve estar em '{self.diretorio_mestre}'.")
+        if pedido.get("modo") is not None and pedido["modo"] not in ESCRITORES:
+            raise ValueError(f"Modo de escrita inválido: {pedido['modo']}")
+
+        id_job = uuid.uuid4().hex
+        with self._trava:
+            self._expirar_jobs()
+            self.jobs[id_job] = {"estado": "na fila"}
+        self.executor.submit(self._executar, id_job, pedido)
+        return id_job
+
+    def _validar_planilhas(self, planilhas):
+        if not isinstance(planilhas, list) or not all(isinstance(c, str) for c in planilhas):
+            raise ValueError("'planilhas' deve ser uma lista de caminhos.")
+        fora = [c for c in planilhas if not _dentro_de(c, self.diretorio_comparacao)]
+        if fora:
+            raise PermissionError(
+                f"As planilhas devem estar em '{self.diretorio_comparacao}': "
+                + ", ".join(os.path.basename(c) for c in fora)
+            )
+
+    def verificar_avisos(self, pedido):
+        """
+        'encontrar_planilhas_com_nao' para um pedido ({'planilhas'}).
+        """
+        if not isinstance(pedido, dict):
+            raise ValueError("O pedido deve ser um objeto JSON.")
+        self._validar_planilhas(pedido.get("planilhas"))
+        return encontrar_planilhas_com_nao(pedido["planilhas"])
+
+    def _expirar_jobs(self):
+        """
+        Remove os jobs terminados há mais de 'validade_jobs' segundos
+        (chamado com 'self._trava' adquirida).
+        """
+        import time
+
+        limite = time.monotonic() - self.validade_jobs
+        expirados = [
+            id_job for id_job, job in self.jobs.items()
+            if job.get("terminado_em", limite) < limite
+        ]
+        for id_job in expirados:
+            del self.jobs[id_job]
+
+    def consultar(self, id_job):
+        with self._trava:
+            self._expirar_jobs()
+            job = dict(self.jobs[id_job])
+        job.pop("terminado_em", None)
+        return job
+
+    def _executar(self, id_job, pedido):
+        import time
+
+        with self._trava:
+            self.jobs[id_job]["estado"] = "executando"
+        try:
+            caminho_saida = self.processar(pedido)
+            atualizacao = {"estado": "concluido", "caminho_saida": caminho_saida}
+        except Exception as e:
+            atualizacao = {"estado": "erro", "erro": str(e)}
+        atualizacao["terminado_em"] = time.monotonic()
+        with self._trava:
+            self.jobs[id_job].update(atualizacao)
+
+    def processar(self, pedido):
+        caminho_mestre = pedido["mestre"]
+        caminhos = pedido["planilhas"]
+
+        # Reserva o nome de saída para que jobs simultâneos não colidam
+        with self._trava:
+            caminho_saida = gerar_nome_arquivo_sugerido(self._nomes_reservados)
+            self._nomes_reservados.add(os.path.normcase(os.path.basename(caminho_saida)))
+
+        try:
+            return executar_comparacao(
+                caminho_mestre, caminhos, self.diretorio_processado,
+                caminho_saida=caminho_saida,
+                modo=pedido.get("modo"),
+                planilha_mestre=self.mestres.obter(caminho_mestre)
+            )
+        finally:
+            with self._trava:
+                self._nomes_reservados.discard(os.path.normcase(os.path.basename(caminho_saida)))
+
+def _criar_manipulador_servico():
+    import json
+    from http.server import BaseHTTPRequestHandler
+
+    class ManipuladorServico(BaseHTTPRequestHandler):
+        """
+        GET  /saude         -> {"ok": true}
+        POST /comparar      -> {"id": ...}
+        POST /avisos        -> {"planilhas": [planilhas com 'NÃO']}
+        GET  /jobs/<id>     -> estado do job
+
+        Os POST só aceitam 'Content-Type: application/json' e sem
+        cabeçalho 'Origin', para que páginas abertas no navegador não
+        consigam enviar pedidos ao serviço.
+        """
+
+        def _responder(self, status, corpo):
+            dados = json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def log_message(self, formato, *args):
+            # A interface consulta os jobs a cada 200 ms; não registra cada acesso
+            pass
+
+        def do_GET(self):
+            servico = self.server.servico
+            if self.path == "/saude":
+                self._responder(200, {"ok": True})
+            elif self.path.startswith("/jobs/"):
+                try:
+                    self._responder(200, servico.consultar(self.path[len("/jobs/"):]))
+                except KeyError:
+                    self._responder(404, {"erro": "Job não encontrado."})
+            else:
+                self._responder(404, {"erro": "Rota não encontrada."})
+
+        def do_POST(self):
+            servico = self.server.servico
+            if self.path not in ("/comparar", "/avisos"):
+                self._responder(404, {"erro": "Rota não encontrada."})
+                return
+            if self.headers.get("Origin") is not None:
+                self._responder(403, {"erro": "Pedidos de navegador não são aceitos."})
+                return
+            tipo = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if tipo != "application/json":
+                self._responder(415, {"erro": "Use 'Content-Type: application/json'."})
+                return
+            try:
+                tamanho = int(self.headers.get("Content-Length", 0))
+                pedido = json.loads(self.rfile.read(tamanho) or b"{}")
+                if self.path == "/comparar":
+                    self._responder(202, {"id": servico.enviar(pedido)})
+                else:
+                    self._responder(200, {"planilhas": servico.verificar_avisos(pedido)})
+            except PermissionError as e:
+                self._responder(403, {"erro": str(e)})
+            except (ValueError, TypeError) as e:
+                self._responder(400, {"erro": str(e)})
+
+    return ManipuladorServico
+
+def iniciar_servico(porta=SERVICO_PORTA, max_workers=4):
+    """
+    Sobe o serviço de comparação em 127.0.0.1:'porta' e atende
+    até ser interrompido.
+    """
+    from http.server import ThreadingHTTPServer
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", porta), _criar_manipulador_servico())
+    servidor.servico = ServicoComparacao(max_workers=max_workers)
+    print(f"Serviço de comparação em http://127.0.0.1:{porta}")
+    try:
+        servidor.serve_forever()
+    finally:
+        servidor.server_close()
+        servidor.servico.executor.shutdown(wait=True)
+
+def _requisicao_servico(caminho, pedido=None, url=SERVICO_URL, timeout=5):
+    import json
+    from urllib.request import Request, urlopen
+
+    dados = json.dumps(pedido).encode("utf-8") if pedido is not None else None
+    requisicao = Request(url + caminho, data=dados, headers={"Content-Type": "application/json"})
+    with urlopen(requisicao, timeout=timeout) as resposta:
+        return json.loads(resposta.read().decode("utf-8"))
+
+def servico_disponivel(url=SERVICO_URL):
+    try:
+        return _requisicao_servico("/saude", url=url, timeout=0.5).get("ok", False)
+    except Exception:
+        return False
+
+def enviar_comparacao_servico(pedido, url=SERVICO_URL):
+    return _requisicao_servico("/comparar", pedido, url=url)["id"]
+
+def consultar_job_servico(id_job, url=SERVICO_URL):
+    return _requisicao_servico(f"/jobs/{id_job}", url=url)
+
+def verificar_avisos_servico(caminhos, url=SERVICO_URL):
+    return _requisicao_servico("/avisos", {"planilhas": caminhos}, url=url, timeout=60)["planilhas"]
+
 # ===============================
 #  FRONT-END (Tkinter)
 # ===============================
@@ -383,6 +1811,10 @@ class ComparadorPlanilhas:
         self.caminho_mestre = None
         self.caminhos_comparacao = []
 
+        # Executor para operações de arquivo fora da thread da interface
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
 
         # Container com azul claro e "opacidade"
         # Container com azul claro e borda verde
@@ -645,8 +2077,15 @@ class ComparadorPlanilhas:
 
 
     def selecionar_mestre(self):
-        diretorio_mestre = r"C:/Comparador de Planilhas/Masterdata/"
+        diretorio_mestre = DIRETORIO_MESTRE
         diretorio_backup = r"C:/Comparador de Planilhas/Backup/"
+
+        def falhar(e):
+            self.botao_mestre.config(bg="#F44336")  # Vermelho
+            self.label_mestre.config(text=f"Erro: {e}")
+
+            self.root.after(3000, lambda: self.reset_cor_botao(self.botao_mestre))
+
         try:
             arquivos = [arq for arq in os.listdir(diretorio_mestre) if arq.lower().endswith(('.xls', '.xlsx', '.xlsb'))]
             if not arquivos:
@@ -655,38 +2094,49 @@ class ComparadorPlanilhas:
             self.caminho_mestre = os.path.join(diretorio_mestre, arquivos[0])
             self.label_mestre.config(text=f"Mestre: {arquivos[0]}")
         
-            # Geração de backup automático
+            # Geração de backup automático (a cópia roda fora da thread da interface)
             os.makedirs(diretorio_backup, exist_ok=True)
-            data_hoje = datetime.now().strftime("%Y-%m-%d")
-            base_nome = f"Planilha Mestre {data_hoje}"
-            numero = 1
-
-            while True:
-                sufixo = f".{numero:02d}"
-                nome_backup = f"{base_nome}{sufixo}{os.path.splitext(self.caminho_mestre)[1]}"
-                caminho_backup = os.path.join(diretorio_backup, nome_backup)
-                if not os.path.exists(caminho_backup):
-                    break
-                numero += 1
+            caminho_backup = gerar_caminho_backup_mestre(self.caminho_mestre, diretorio_backup)
 
-            import shutil
-            shutil.copy2(self.caminho_mestre, caminho_backup)
+            def concluir(_):
+                # Indicação visual de sucesso
+                self.botao_mestre.config(bg="#4CAF50")  # Verde
+                self.label_mestre.config(text=f"Mestre: {arquivos[0]} \n BACKUP CRIADO!")
 
-            # Indicação visual de sucesso
-            self.botao_mestre.config(bg="#4CAF50")  # Verde
-            self.label_mestre.config(text=f"Mestre: {arquivos[0]} \n BACKUP CRIADO!")
+                self.root.after(5000, lambda: self.reset_cor_botao(self.botao_mestre))
 
-            self.root.after(5000, lambda: self.reset_cor_botao(self.botao_mestre))
+            import shutil
+            self._executar_em_segundo_plano(
+                lambda caminho=self.caminho_mestre: shutil.copy2(caminho, caminho_backup),
+                concluir,
+                falhar
+            )
 
         except Exception as e:
-            self.botao_mestre.config(bg="#F44336")  # Vermelho
-            self.label_mestre.config(text=f"Erro: {e}")
+            falhar(e)
+
+    def _executar_em_segundo_plano(self, funcao, ao_concluir, ao_falhar):
+        """
+        Executa 'funcao' no executor da interface e chama 'ao_concluir'
+        (com o resultado) ou 'ao_falhar' (com a exceção) na thread do Tkinter.
+        """
+        futuro = self.executor.submit(funcao)
+
+        def verificar():
+            if not futuro.done():
+                self.root.after(100, verificar)
+                return
+            erro = futuro.exception()
+            if erro:
+                ao_falhar(erro)
+            else:
+                ao_concluir(futuro.result())
 
-            self.root.after(3000, lambda: self.reset_cor_botao(self.botao_mestre))
+        self.root.after(100, verificar)
 
 
     def carregar_comparacao_automatica(self):
-        diretorio_comparacao = r"C:/Comparador de Planilhas/Extras Planilhas/"
+        diretorio_comparacao = DIRETORIO_COMPARACAO
         try:
             arquivos = [os.path.join(diretorio_comparacao, arq) 
                         for arq in os.listdir(diretorio_comparacao) 
@@ -701,48 +2151,11 @@ class ComparadorPlanilhas:
                 fg="white"
             )
 
-            planilhas_com_nao = []
-
-            for caminho in arquivos:
-                try:
-                    # Lê a planilha original sem filtrar por SIM ou X
-                    df_original = pd.read_excel(
-                        caminho,
-                        engine='pyxlsb' if caminho.lower().endswith('.xlsb') else None,
-                        header=None
-                    )
-
-                    # Detecta cabeçalho
-                    colunas_desejadas = [
-                        "Reg.", "Nome empregado", "Unidade de Negócio", "Turno",
-                        "Optante de transporte", "Usará transporte na HE", "LANCHE",
-                        "HORARIO DE SAÍDA", "OBSERVAÇÃO"
-                    ]
-                    header_unificado, idx_cabecalho = encontrar_cabecalho_personalizado(df_original, colunas_desejadas)
-                    df_original.columns = header_unificado
-                    df_original = df_original.iloc[idx_cabecalho + 1:]
-
-                    # Renomeia as colunas que nos interessam
-                    for c in df_original.columns:
-                        if "optante de transporte" in c.lower():
-                            df_original.rename(columns={c: "Optante de transporte"}, inplace=True)
-                        if "usará transporte na he" in c.lower():
-                            df_original.rename(columns={c: "Usará transporte na HE"}, inplace=True)
-
-                    if "Optante de transporte" in df_original.columns and "Usará transporte na HE" in df_original.columns:
-                        df_original["Optante de transporte"] = df_original["Optante de transporte"].astype(str).str.upper().str.strip()
-                        df_original["Usará transporte na HE"] = df_original["Usará transporte na HE"].astype(str).str.upper().str.strip()
-
-                        cond = (
-                            (df_original["Optante de transporte"] == "NÃO") &
-                            (df_original["Usará transporte na HE"] == "NÃO")
-                        )
-                        if cond.any():
-                            planilhas_com_nao.append(os.path.basename(caminho))
-
-                except Exception as e:
-                    print(f"Erro ao processar planilha {caminho}: {e}")
-                    continue
+            # Com o serviço no ar, a verificação roda nele (a interface não carrega o openpyxl)
+            if servico_disponivel():
+                planilhas_com_nao = verificar_avisos_servico([os.path.abspath(c) for c in arquivos])
+            else:
+                planilhas_com_nao = encontrar_planilhas_com_nao(arquivos)
 
             if planilhas_com_nao:
                 lista_horizontal = ", ".join(planilhas_com_nao)
@@ -765,61 +2178,72 @@ class ComparadorPlanilhas:
 
 
     def comparar_planilhas(self):
-        diretorio_processado = r"C:/Comparador de Planilhas/Extras Planilhas Processadas/"
-        try:
-            if self.caminho_mestre and self.caminhos_comparacao:
-                df_resultado = comparar_planilhas(self.caminho_mestre, self.caminhos_comparacao)
-
-                caminho_saida = gerar_nome_arquivo_sugerido()
-                os.makedirs(os.path.dirname(caminho_saida), exist_ok=True)
-
-                salvar_planilha_com_estilo(df_resultado, caminho_saida)
+        diretorio_processado = DIRETORIO_PROCESSADO
 
-                import shutil
-                os.makedirs(diretorio_processado, exist_ok=True)
+        def concluir():
+            # Indicação visual de sucesso
+            self.botao_comparar.hover_ativo = False  # desativa o hover
+            self.botao_comparar.config(bg="#4CAF50")  # Verde
+            self.label_movido.config(
+                text="Planilhas movidas para 'Extras Planilhas Processadas'.",
+                fg="#00ff00"
+            )
 
-                for caminho in self.caminhos_comparacao:
-                    nome_arquivo = os.path.basename(caminho)
-                    destino = os.path.join(diretorio_processado, nome_arquivo)
 
-                    contador = 1
-                    base, extensao = os.path.splitext(nome_arquivo)
-                    while os.path.exists(destino):
-                        destino = os.path.join(diretorio_processado, f"{base}_{contador:02d}{extensao}")
-                        contador += 1
+            # Garante cancelamento prévio caso já exista timer
+            if self.botao_comparar.after_id:
+                self.root.after_cancel(self.botao_comparar.after_id)
 
-                    shutil.move(caminho, destino)
-
-                # Indicação visual de sucesso
-                self.botao_comparar.hover_ativo = False  # desativa o hover
-                self.botao_comparar.config(bg="#4CAF50")  # Verde
-                self.label_movido.config(
-                    text="Planilhas movidas para 'Extras Planilhas Processadas'.",
-                    fg="#00ff00"
-                )
+            self.root.after(5000, lambda: self.reset_cor_botao(self.botao_comparar))
 
+            self.caminhos_comparacao = []
+            self.label_comparacao.config(text="Nenhuma planilha carregada.")
 
-                # Garante cancelamento prévio caso já exista timer
-                if self.botao_comparar.after_id:
-                    self.root.after_cancel(self.botao_comparar.after_id)
+        def falhar(e):
+            self.botao_comparar.config(bg="#ff5a5a")  # Vermelho
+            self.label_movido.config(
+                text=f"Erro: {e}",
+                fg="#ff4444"
+            )
 
-                self.root.after(5000, lambda: self.reset_cor_botao(self.botao_comparar))
+            self.root.after(3000, lambda: self.reset_cor_botao(self.botao_comparar))
 
-                self.caminhos_comparacao = []
-                self.label_comparacao.config(text="Nenhuma planilha carregada.")
+        try:
+            if self.caminho_mestre and self.caminhos_comparacao:
+                # Com o serviço local no ar, ele executa o job com a mestre já carregada
+                if servico_disponivel():
+                    id_job = enviar_comparacao_servico({
+                        "mestre": os.path.abspath(self.caminho_mestre),
+                        "planilhas": [os.path.abspath(c) for c in self.caminhos_comparacao],
+                    })
+                    self._acompanhar_job(id_job, concluir, falhar)
+                else:
+                    executar_comparacao(self.caminho_mestre, self.caminhos_comparacao, diretorio_processado)
+                    concluir()
 
             else:
                 raise ValueError("Planilha mestre ou planilhas de \n"
                 "comparação não foram selecionadas!")
 
         except Exception as e:
-            self.botao_comparar.config(bg="#ff5a5a")  # Vermelho
-            self.label_movido.config(
-                text=f"Erro: {e}",
-                fg="#ff4444"
-            )
+            falhar(e)
 
-            self.root.after(3000, lambda: self.reset_cor_botao(self.botao_comparar))
+    def _acompanhar_job(self, id_job, ao_concluir, ao_falhar):
+        """
+        Consulta o job no serviço local a cada 200 ms até terminar.
+        """
+        try:
+            job = consultar_job_servico(id_job)
+        except Exception as e:
+            ao_falhar(e)
+            return
+
+        if job["estado"] == "concluido":
+            ao_concluir()
+        elif job["estado"] == "erro":
+            ao_falhar(job["erro"])
+        else:
+            self.root.after(200, lambda: self._acompanhar_job(id_job, ao_concluir, ao_falhar))
 
 
 
@@ -845,7 +2269,62 @@ class ComparadorPlanilhas:
 # ===============================
 # MAIN
 # ===============================
+def medir_escrita_cli(caminho_mestre, caminhos_comparacao):
+    """
+    Executa a comparação e imprime tamanho e tempo de gravação
+    de cada escritor, lado a lado.
+    """
+    planilha = comparar_planilhas(caminho_mestre, caminhos_comparacao)
+    for modo, medida in medir_escritores(planilha).items():
+        print(f"{modo:<12} {medida['bytes'] / 1024:>10.1f} KB {medida['segundos']:>8.3f} s")
+
+
+def reprocessar_cli(datas):
+    """
+    Reprocessa as planilhas arquivadas ('datas' = [] ou [INICIAL] ou
+    [INICIAL, FINAL]) e imprime os arquivos gerados.
+    """
+    gerados = reprocessar_periodo(*datas[:2])
+    for execucao, caminho in gerados.items():
+        print(f"{execucao}: {caminho}")
+
+
+def delta_cli(execucao_antes, execucao_depois):
+    """
+    Imprime os passageiros adicionados, removidos e alterados
+    entre duas execuções do histórico.
+    """
+    delta = calcular_delta(identificar_execucao(execucao_antes), identificar_execucao(execucao_depois))
+    for tipo, df in delta.items():
+        print(f"\n=== {tipo.capitalize()}: {len(df)} ===")
+        if not df.empty:
+            print(df.to_string(index=False))
+
+
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = ComparadorPlanilhas(root)
-    root.mainloop()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Comparador de Planilhas")
+    parser.add_argument("--medir-escrita", nargs="+", metavar=("MESTRE", "PLANILHA"),
+                        help="compara os escritores de saída (tamanho e tempo)")
+    parser.add_argument("--delta", nargs=2, metavar=("ANTES", "DEPOIS"),
+                        help="diferença entre duas execuções do histórico (AAAA-MM-DD.NN)")
+    parser.add_argument("--servico", action="store_true",
+                        help=f"inicia o serviço local de comparação (porta {SERVICO_PORTA})")
+    parser.add_argument("--reprocessar", nargs="*", metavar="DATA",
+                        help="regera os relatórios das planilhas arquivadas "
+                             "(opcional: DATA_INICIAL [DATA_FINAL], AAAA-MM-DD)")
+    args = parser.parse_args()
+
+    if args.medir_escrita:
+        medir_escrita_cli(args.medir_escrita[0], args.medir_escrita[1:])
+    elif args.delta:
+        delta_cli(*args.delta)
+    elif args.reprocessar is not None:
+        reprocessar_cli(args.reprocessar)
+    elif args.servico:
+        iniciar_servico()
+    else:
+        root = tk.Tk()
+        app = ComparadorPlanilhas(root)
+        root.mainloop()
\ No newline at end of file